@@ -1,56 +1,93 @@
 import requests
 import pandas as pd
+import argparse
 import os
 import io
+import random
+import re
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import pytz
 
-def fetch_jepx_data():
-    JST = pytz.timezone('Asia/Tokyo')
-    now = datetime.now(JST)
-    fy = now.year if now.month >= 4 else now.year - 1
-    target_date = now.strftime('%Y/%m/%d')
+JST = pytz.timezone('Asia/Tokyo')
 
-    os.makedirs('data', exist_ok=True)
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                      "AppleWebKit/537.36 (KHTML, like Gecko) "
-                      "Chrome/91.0.4472.124 Safari/537.36"
-    }
+# 取得元（ローカルの代替サーバーで試験する場合は JEPX_BASE_URL で上書き）
+BASE_URL = os.environ.get('JEPX_BASE_URL', 'https://www.jepx.jp/market/excel')
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# 公開検知でダウンロードするCSV末尾のバイト数
+# （JEPXの1日分48行は約9KBのため、1週間分程度が収まる大きさにする）
+TAIL_BYTES = 65536
 
-    url = f"https://www.jepx.jp/market/excel/spot_{fy}.csv"
+# レポートの対象日（send_daily_report.py と同じく翌日分を送信する）
+REPORT_DAYS_AHEAD = 1
+
+# レポート送信の再試行（従来の workflow-mail.yml の retry 設定と同じ）
+REPORT_ATTEMPTS = 5
+REPORT_WAIT_SECONDS = 300
+
+DATE_PATTERN = re.compile(r'\d{4}/\d{2}/\d{2}')
+
+
+def _target(now, days_ahead=0):
+    """会計年度（4月起点）・対象日・取得URL・保存先を返す"""
+    fy = now.year if now.month >= 4 else now.year - 1
+    target_date = (now + timedelta(days=days_ahead)).strftime('%Y/%m/%d')
+    url = f"{BASE_URL.rstrip('/')}/spot_{fy}.csv"
     save_path = f"data/spot_{fy}.csv"
+    return target_date, url, save_path
+
+
+def fetch_jepx_data(session=None, content=None, target_date=None):
+    """
+    CSVを全件取得・検証して保存する。成功時 True、失敗時 False を返す。
+    content に取得済みの本文（bytes）を渡した場合は再ダウンロードしない。
+    target_date を省略した場合は当日分の公開を確認する。
+    """
+    now = datetime.now(JST)
+    today, url, save_path = _target(now)
+    target_date = target_date or today
+    http = session or requests
+
+    os.makedirs('data', exist_ok=True)
 
     print(f"[{now.strftime('%H:%M:%S')} JST] 取得開始")
     print(f"対象日: {target_date}")
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        response.encoding = 'shift_jis'
+        if content is None:
+            response = http.get(url, headers=HEADERS, timeout=15)
+            response.raise_for_status()
+            content = response.content
+        text = content.decode('shift_jis', errors='replace')
 
         # チェック1: HTMLが返ってきていないか
-        if '<html' in response.text.lower():
+        if '<html' in text.lower():
             print("FAIL: HTMLレスポンス（アクセス制限）")
-            sys.exit(1)
+            return False
 
-        df = pd.read_csv(io.StringIO(response.text))
+        df = pd.read_csv(io.StringIO(text))
         date_col = '年月日'
         time_col = '時刻コード'
 
         # チェック2: 必須列の存在確認
         if date_col not in df.columns or time_col not in df.columns:
             print(f"FAIL: 必須列なし。検出列: {list(df.columns)}")
-            sys.exit(1)
+            return False
 
         # チェック3: 当日データの存在確認
         latest_date = df[date_col].max()
         print(f"CSV最新日付: {latest_date} / 期待: {target_date}")
 
         if latest_date < target_date:
-            print(f"FAIL: 当日データ未公開。retryします。")
-            sys.exit(1)
+            print("FAIL: 当日データ未公開。retryします。")
+            return False
 
         # チェック4: エリア列の存在確認
         area_keywords = [
@@ -65,7 +102,7 @@ def fetch_jepx_data():
 
         if not found_columns:
             print(f"FAIL: エリア列なし。検出列: {list(df.columns)}")
-            sys.exit(1)
+            return False
 
         # 変換・保存
         df_melted = pd.melt(
@@ -87,16 +124,175 @@ def fetch_jepx_data():
         if len(today_rows) < expected_rows_per_day:
             print(f"FAIL: 当日データ不完全 "
                   f"({len(today_rows)}/{expected_rows_per_day}件)")
-            sys.exit(1)
+            return False
 
         df_final.to_csv(save_path, index=False)
         print(f"SUCCESS: {len(df_final)}件保存 / 当日{len(today_rows)}件確認")
+        return True
 
-    except SystemExit:
-        raise
     except Exception as e:
         print(f"FAIL: 予期しないエラー: {e}")
-        sys.exit(1)
+        return False
+
+
+def _validators(response):
+    """HEADレスポンスから更新検知用の識別子を取り出す（無ければ None）"""
+    keys = ('ETag', 'Last-Modified', 'Content-Length')
+    values = tuple(response.headers.get(k) for k in keys)
+    return values if any(values) else None
+
+
+def probe_latest_date(session, url):
+    """
+    CSV末尾だけを Range 取得し、含まれる最新の年月日を返す（読めなければ None）。
+    サーバーが Range 非対応で全件が返った場合は、その本文も併せて返す。
+    """
+    headers = dict(HEADERS, Range=f"bytes=-{TAIL_BYTES}")
+    response = session.get(url, headers=headers, timeout=15)
+    response.raise_for_status()
+
+    if response.status_code == 206:
+        body = None
+        lines = response.content.decode('shift_jis', errors='ignore').splitlines()
+        # ファイル先頭からでなければ1行目は途中から始まるため捨てる
+        if not response.headers.get('Content-Range', '').startswith('bytes 0-'):
+            lines = lines[1:]
+    else:
+        body = response.content
+        lines = body.decode('shift_jis', errors='ignore').splitlines()
+
+    dates = [
+        field for field in (line.split(',', 1)[0].strip() for line in lines)
+        if DATE_PATTERN.fullmatch(field)
+    ]
+    return (max(dates) if dates else None), body
+
+
+def report_data_ready(save_path, target_date):
+    """保存済みCSVにレポート対象日の行があるかを確認する"""
+    try:
+        df = pd.read_csv(save_path, usecols=['date'])
+    except (OSError, ValueError) as e:
+        print(f"レポート用データ読み込みエラー: {e}")
+        return False
+    return bool((df['date'] == target_date).any())
+
+
+def send_reports_with_retry(attempts=REPORT_ATTEMPTS, wait=REPORT_WAIT_SECONDS):
+    """
+    メール送信を同一プロセスで実行し、失敗時は間隔を空けて再試行する。
+    対象日のデータは呼び出し側で確認済みのため、再試行するのは描画・送信の失敗のみ。
+    """
+    from send_daily_report import send_daily_reports
+
+    for attempt in range(1, attempts + 1):
+        try:
+            send_daily_reports()
+            return True
+        except SystemExit as e:
+            if e.code in (0, None):
+                return True
+            print(f"レポート送信失敗（{attempt}/{attempts}回目）")
+        except Exception as e:
+            print(f"レポート送信失敗（{attempt}/{attempts}回目）: {e}")
+        if attempt < attempts:
+            print(f"{wait:.0f}秒後に再送信します")
+            time.sleep(wait)
+
+    print("FAIL: レポート送信の再試行上限に達しました")
+    return False
+
+
+def watch_jepx_data(timeout_minutes=60, min_interval=15, max_interval=30,
+                    report=False, target_date=None):
+    """
+    公開されるまで軽量なポーリングで待機し、検知後に全件取得する。
+    HEADで変化が無ければ末尾取得も省略し、待機は指数バックオフ＋ジッター。
+    HEADの内容が前回から変わった場合は間隔を min_interval に戻す。
+    report=True の場合は同一プロセスでメール送信まで続けて実行する。
+    target_date を省略した場合、report=True なら翌日分、それ以外は当日分を待つ。
+    """
+    days_ahead = REPORT_DAYS_AHEAD if report else 0
+    default_date, url, save_path = _target(datetime.now(JST), days_ahead)
+    target_date = target_date or default_date
+    deadline = time.monotonic() + timeout_minutes * 60
+    session = requests.Session()
+    last_seen = None
+    previous = None
+    delay = min_interval
+
+    print(f"監視開始: {url} / 対象日: {target_date} / 上限{timeout_minutes}分")
+
+    while True:
+        changed = False
+        try:
+            head = session.head(url, headers=HEADERS, timeout=15,
+                                allow_redirects=True)
+            current = _validators(head) if head.ok else None
+            changed = None not in (current, previous) and current != previous
+            previous = current
+            if current is not None and current == last_seen:
+                print("未更新（HEAD変化なし）")
+            else:
+                latest_date, body = probe_latest_date(session, url)
+                if latest_date is None:
+                    print("CSV末尾から年月日を読み取れませんでした")
+                elif latest_date < target_date:
+                    print(f"対象日データ未公開（CSV最新日付: {latest_date}）")
+                    # 未公開と確認できた場合のみ、同じ内容の再確認を省く
+                    last_seen = current
+                elif fetch_jepx_data(session, body, target_date):
+                    if not report or report_data_ready(save_path, target_date):
+                        break
+                    # 送信に必要なデータが無ければ再送信せず監視に戻る
+                    print(f"レポート対象日 {target_date} のデータがありません")
+        except requests.RequestException as e:
+            print(f"監視エラー: {e}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"FAIL: {timeout_minutes}分以内に公開を検知できませんでした")
+            return False
+
+        wait = min(random.uniform(delay / 2, delay), remaining)
+        print(f"{wait:.0f}秒後に再確認します")
+        time.sleep(wait)
+        delay = min_interval if changed else min(delay * 2, max_interval)
+
+    if report:
+        # 取得直後にそのままレポート送信へ引き継ぐ（pandas等の再importを省く）
+        return send_reports_with_retry()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JEPXスポット価格の取得")
+    parser.add_argument('--watch', action='store_true',
+                        help="公開を検知するまで待機してから取得する")
+    parser.add_argument('--report', action='store_true',
+                        help="翌日分の取得成功後にメール送信を同一プロセスで実行する")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="監視の上限時間（分）")
+    parser.add_argument('--min-interval', type=float, default=15,
+                        help="ポーリング間隔の初期値（秒）")
+    parser.add_argument('--max-interval', type=float, default=30,
+                        help="ポーリング間隔の上限（秒）")
+    args = parser.parse_args()
+
+    if args.watch:
+        ok = watch_jepx_data(args.timeout, args.min_interval,
+                             args.max_interval, report=args.report)
+    else:
+        if args.report:
+            target_date, _, save_path = _target(datetime.now(JST),
+                                                REPORT_DAYS_AHEAD)
+            ok = (fetch_jepx_data(target_date=target_date)
+                  and report_data_ready(save_path, target_date)
+                  and send_reports_with_retry())
+        else:
+            ok = fetch_jepx_data()
+    sys.exit(0 if ok else 1)
+
 
 if __name__ == "__main__":
-    fetch_jepx_data()
+    main()
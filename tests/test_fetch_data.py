@@ -0,0 +1,217 @@
+import sys
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_data
+
+AREAS = ['北海道', '東北', '東京', '中部', '北陸', '関西', '中国', '四国', '九州']
+COLUMNS = (
+    ['年月日', '時刻コード', '売り入札量(kWh)', '買い入札量(kWh)', '約定総量(kWh)',
+     'システムプライス(円/kWh)']
+    + [f'エリアプライス{a}(円/kWh)' for a in AREAS]
+    + [f'回避可能原価{a}(円/kWh)' for a in AREAS]
+    + ['売りブロック入札総量(kWh)', '売りブロック約定総量(kWh)',
+       '買いブロック入札総量(kWh)', '買いブロック約定総量(kWh)',
+       '売り入札量(kWh)', '買い入札量(kWh)']
+)
+
+
+def _day(date):
+    """JEPX実データと同程度（約190バイト/行）の1日分48行を返す"""
+    values = ['12345678', '23456789', '11223344', '10.05'] + ['12.34'] * 24
+    return ''.join(
+        f"{date.strftime('%Y/%m/%d')},{code}," + ','.join(values) + '\n'
+        for code in range(1, 49)
+    )
+
+
+def _csv(base, days_ahead):
+    """前日〜(当日+days_ahead)までのCSVをShift_JISで返す（days_ahead<0 は前日まで）"""
+    text = ','.join(COLUMNS) + '\n'
+    for offset in range(-1, days_ahead + 1):
+        text += _day(base + timedelta(days=offset))
+    return text.encode('shift_jis')
+
+
+class StandInServer:
+    """一定時間後に新しいCSVを公開する JEPX の代替サーバー"""
+
+    def __init__(self, old, new, publish_after, support_range=True):
+        self.old = old
+        self.new = new
+        self.publish_at = time.monotonic() + publish_after
+        self.support_range = support_range
+        self.requests = []
+        self.fetch_times = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _body(self):
+                if time.monotonic() >= server.publish_at:
+                    return server.new, '"new"'
+                return server.old, '"old"'
+
+            def do_HEAD(self):
+                body, etag = self._body()
+                server.requests.append(('HEAD', None))
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+
+            def do_GET(self):
+                body, etag = self._body()
+                rng = self.headers.get('Range')
+                server.requests.append(('GET', rng))
+                if rng is None:
+                    server.fetch_times.append(time.monotonic())
+                if rng and server.support_range:
+                    size = len(body)
+                    start = max(size - int(rng.split('-')[-1]), 0)
+                    self.send_response(206)
+                    self.send_header('Content-Range',
+                                     f'bytes {start}-{size - 1}/{size}')
+                    body = body[start:]
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, method, ranged=None):
+        return sum(1 for m, rng in self.requests if m == method
+                   and (ranged is None or (rng is not None) == ranged))
+
+
+# 監視開始時刻を固定する（JST 2026/10/19 12:30、会計年度は2026）
+NOW = fetch_data.JST.localize(datetime(2026, 10, 19, 12, 30))
+TODAY = NOW.strftime('%Y/%m/%d')
+TOMORROW = (NOW + timedelta(days=1)).strftime('%Y/%m/%d')
+SAVE_PATH = 'data/spot_2026.csv'
+
+
+class FrozenDateTime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture(autouse=True)
+def frozen(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fetch_data, 'datetime', FrozenDateTime)
+
+
+def _watch(server, monkeypatch, timeout_minutes=0.2, **kwargs):
+    monkeypatch.setattr(fetch_data, 'BASE_URL', server.url)
+    return fetch_data.watch_jepx_data(
+        timeout_minutes=timeout_minutes, min_interval=0.1, max_interval=0.3,
+        **kwargs)
+
+
+def _fake_report(monkeypatch, send):
+    module = types.ModuleType('send_daily_report')
+    module.send_daily_reports = send
+    monkeypatch.setitem(sys.modules, 'send_daily_report', module)
+
+
+def _saved_dates():
+    return set(line.split(',', 1)[0] for line in open(SAVE_PATH, encoding='utf-8'))
+
+
+@pytest.mark.parametrize('support_range', [True, False])
+def test_watch_fetches_after_publication(monkeypatch, support_range):
+    old, new = _csv(NOW, -1), _csv(NOW, 0)
+    with StandInServer(old, new, publish_after=0.5,
+                       support_range=support_range) as server:
+        assert _watch(server, monkeypatch, target_date=TODAY)
+
+    assert TODAY in _saved_dates()
+    # 公開検知後の全件取得は1回だけ（Range非対応時は検知時の本文を再利用）
+    assert server.count('GET', ranged=False) == (1 if support_range else 0)
+    assert server.count('HEAD') > 0
+
+
+@pytest.mark.parametrize('support_range', [True, False])
+def test_watch_reports_tomorrow_after_publication(monkeypatch, support_range):
+    # 当日分は前日に公開済みで、当日の公開で翌日分48行（約9KB）が末尾に加わる
+    old, new = _csv(NOW, 0), _csv(NOW, 1)
+    reported = []
+    _fake_report(monkeypatch, lambda: reported.append(time.monotonic()))
+
+    with StandInServer(old, new, publish_after=1.0,
+                       support_range=support_range) as server:
+        # target_date を渡さず、report=True から翌日分を待つことを確認する
+        assert _watch(server, monkeypatch, report=True)
+
+    assert TOMORROW in _saved_dates()
+    # 公開前に全件取得・レポート送信をしていないこと
+    assert len(reported) == 1
+    assert reported[0] >= server.publish_at
+    assert server.count('GET', ranged=False) == (1 if support_range else 0)
+    assert all(t >= server.publish_at for t in server.fetch_times)
+
+
+def test_watch_times_out_when_not_published(monkeypatch):
+    old = _csv(NOW, 0)
+    with StandInServer(old, old, publish_after=0) as server:
+        assert not _watch(server, monkeypatch, timeout_minutes=0.05,
+                          target_date=TOMORROW)
+    # 未公開を確認した後は HEAD が変わらない限り末尾取得を省く
+    assert server.count('GET') == 1
+    assert server.count('GET', ranged=False) == 0
+    assert server.count('HEAD') > 1
+
+
+def test_probe_skips_partial_first_line(monkeypatch):
+    monkeypatch.setattr(fetch_data, 'TAIL_BYTES', 300)
+    body = _csv(NOW, 1)
+    with StandInServer(body, body, publish_after=0) as server:
+        session = fetch_data.requests.Session()
+        latest, full = fetch_data.probe_latest_date(
+            session, f'{server.url}/spot.csv')
+    assert latest == TOMORROW
+    assert full is None
+
+
+def test_report_retries_until_success(monkeypatch):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise SystemExit(1)
+
+    _fake_report(monkeypatch, flaky)
+    assert fetch_data.send_reports_with_retry(attempts=5, wait=0)
+    assert len(calls) == 3
+
+
+def test_report_gives_up_after_attempts(monkeypatch):
+    def broken():
+        raise RuntimeError('kaleido')
+
+    _fake_report(monkeypatch, broken)
+    assert not fetch_data.send_reports_with_retry(attempts=2, wait=0)